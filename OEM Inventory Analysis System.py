@@ -1,11 +1,14 @@
 import pandas as pd
 import numpy as np
 import streamlit as st
-from streamlit_lottie import st_lottie
-import requests
 import time
-import matplotlib.pyplot as plt
+import io
 import re
+import functools
+import hashlib
+import json
+from pathlib import Path
+from collections import namedtuple
 
 st.set_page_config(
     page_title="OEM Inventory Analysis System",
@@ -19,6 +22,23 @@ INFLATION_RATES = {
     2021: 5.1, 2022: 6.7, 2023: 5.7,
     2024: 4.9, 2025: 3.16, 2026: 4.5, 2027: 4.5
 }
+DEFAULT_INFLATION_RATE = 4.5
+
+LOTTIE_CACHE_DIR = Path.home() / ".cache" / "oem_inventory"
+
+# Cumulative inflation growth: CUMFACTOR[y - INFLATION_START] is the growth from INFLATION_START to y
+INFLATION_START, INFLATION_END = 1900, 2100
+
+def _cumulative_inflation():
+    years = range(INFLATION_START + 1, INFLATION_END + 1)
+    rates = np.array([INFLATION_RATES.get(y, DEFAULT_INFLATION_RATE) for y in years]) / 100.0
+    return np.concatenate([[1.0], np.cumprod(1.0 + rates)])
+
+CUMFACTOR = _cumulative_inflation()
+
+# Year column detection
+_YEAR_RE = re.compile(r'\d{2,4}')
+_YEAR_COL_RE = re.compile(r'^\d{4}$|^FY\d{2}$', re.IGNORECASE)
 
 def format_indian_number(num):
     try:
@@ -34,6 +54,20 @@ def format_indian_number(num):
     except:
         return str(num)
 
+def format_indian_series(s):
+    """Vectorized format_indian_number for a whole column"""
+    v = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float)
+    absv = np.abs(v)
+    out = np.full(len(v), "-", dtype=object)
+    # Format each cell once, only in the branch it falls into
+    small = absv < 100000
+    lakh = (absv >= 100000) & (absv < 10000000)
+    crore = absv >= 10000000
+    out[small] = [f"{x:,.2f}" for x in v[small].tolist()]
+    out[lakh] = [f"{x:.2f} Lakh" for x in (v[lakh] / 100000).tolist()]
+    out[crore] = [f"{x:.2f} Crore" for x in (v[crore] / 10000000).tolist()]
+    return pd.Series(out, index=s.index, name=s.name)
+
 # Custom CSS
 st.markdown("""
 <style>
@@ -82,83 +116,177 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def _fetch_lottie(url):
+    """Fetch animation JSON; raises on failure so errors are not cached"""
+    # Reuse a copy saved by an earlier process before going to the network
+    cache_file = LOTTIE_CACHE_DIR / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+    try:
+        return json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        pass
+    import requests
+    r = requests.get(url, timeout=10)
+    r.raise_for_status()
+    animation = r.json()
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps(animation))
+    except OSError:
+        pass
+    return animation
+
 def load_lottie(url):
     try:
-        r = requests.get(url, timeout=10)
-        return r.json() if r.status_code == 200 else None
+        return _fetch_lottie(url)
     except:
         return None
 
+@functools.lru_cache(maxsize=None)
 def inflation_factor(base_year, target_year):
-    factor = 1.0
-    for year in range(base_year+1, target_year+1):
-        rate = INFLATION_RATES.get(year, 4.5)
-        factor *= (1 + rate/100)
-    return factor
+    base, target = (int(np.clip(y, INFLATION_START, INFLATION_END)) for y in (base_year, target_year))
+    # Years outside the table grow at the default rate
+    outside = (target_year - target) - (base_year - base)
+    factor = CUMFACTOR[target - INFLATION_START] / CUMFACTOR[base - INFLATION_START]
+    return float(factor * (1 + DEFAULT_INFLATION_RATE/100) ** outside)
 
-def calculate_equipment_lifetime(usage_years):
-    """Calculate inventory lifetime based on usage gaps"""
-    if len(usage_years) < 2:
-        return None
-    
-    sorted_years = sorted(usage_years)
-    gaps = []
-    for i in range(1, len(sorted_years)):
-        gap = sorted_years[i] - sorted_years[i-1]
-        gaps.append(gap)
-    
-    if not gaps:
-        return None
+def calculate_equipment_lifetime(year_arr, used):
+    """Calculate inventory lifetime per row from usage gaps over ascending year_arr (0 where undetermined)"""
+    # Index of the most recent usage strictly before each year column
+    idx = np.where(used, np.arange(len(year_arr)), -1)
+    prev_idx = np.maximum.accumulate(idx, axis=1)[:, :-1]
+    has_prev = used[:, 1:] & (prev_idx >= 0)
+    gaps = np.where(has_prev, year_arr[1:] - year_arr[prev_idx], 0)
     
     # Use the maximum gap as lifetime indicator
-    return max(gaps)
+    return gaps.max(axis=1, initial=0)
 
-def predict_replenishment_events(historical_years, target_year):
-    """Predict all replenishment events up to target year"""
-    lifetime = calculate_equipment_lifetime(historical_years)
-    if lifetime is None:
-        return []
-    
-    last_usage = max(historical_years)
-    events = []
-    next_replenishment = last_usage + lifetime
-    
-    while next_replenishment <= target_year:
-        events.append(next_replenishment)
-        next_replenishment += lifetime
+def predict_replenishment_events(year_arr, used, target_year):
+    """Predict replenishment events up to target year; returns (row, last usage, event year) arrays"""
+    # Lifetime and last usage need the year columns in ascending order
+    order = np.argsort(year_arr, kind="stable")
+    year_arr, used = year_arr[order], used[:, order]
+    lifetime = calculate_equipment_lifetime(year_arr, used)
+    last_usage = year_arr[len(year_arr) - 1 - used[:, ::-1].argmax(axis=1)]
     
-    return events
+    valid = lifetime > 0
+    counts = np.where(valid, (target_year - last_usage) // np.where(valid, lifetime, 1), 0).clip(min=0)
+    rows = np.repeat(np.arange(len(used)), counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    return rows, last_usage[rows], last_usage[rows] + lifetime[rows] * steps
 
 def detect_year_columns(df):
     """Detect year columns using regex pattern"""
-    pattern = re.compile(r'^\d{4}$|^FY\d{2}$', re.IGNORECASE)
-    year_cols = [col for col in df.columns if pattern.match(str(col).strip())]
-    return sorted(year_cols, key=lambda x: int(re.search(r'\d{2,4}', str(x)).group()))
+    year_cols = [col for col in df.columns if _YEAR_COL_RE.match(str(col).strip())]
+    return sorted(year_cols, key=convert_to_year)
 
+@functools.lru_cache(maxsize=None)
 def convert_to_year(col_name):
     """Convert column name to year integer"""
-    year_str = re.search(r'\d{2,4}', str(col_name)).group()
+    year_str = _YEAR_RE.search(str(col_name)).group()
     if len(year_str) == 2:
         return 2000 + int(year_str) if int(year_str) < 50 else 1900 + int(year_str)
     return int(year_str)
 
-def load_and_clean_data(uploaded_file):
-    """Load and clean data from uploaded file"""
+def year_presence(year_mask, year_arr):
+    """Unpack a year bitmask into a materials x years usage matrix"""
+    return np.unpackbits(year_mask, axis=1, count=len(year_arr), bitorder="little").astype(bool)
+
+def load_and_clean_data(file_bytes, filename):
+    """Load and clean data from uploaded file contents"""
+    if not filename.endswith(('.xlsx', '.csv')):
+        raise ValueError("Unsupported file format. Please upload XLSX or CSV.")
     try:
-        if uploaded_file.name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file)
-        elif uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
+        if filename.endswith('.xlsx'):
+            df = pd.read_excel(io.BytesIO(file_bytes))
         else:
-            st.error("Unsupported file format. Please upload XLSX or CSV.")
-            return None
+            try:
+                # Arrow's multithreaded parser; fall back for files it rejects
+                df = pd.read_csv(io.BytesIO(file_bytes), engine='pyarrow')
+            except Exception:
+                df = pd.read_csv(io.BytesIO(file_bytes))
             
         # Clean column names
         df.columns = df.columns.str.strip()
         return df
     except Exception as e:
-        st.error(f"Error reading file: {str(e)}")
-        return None
+        raise ValueError(f"Error reading file: {str(e)}")
+
+# Cached outputs of build_results; year_mask and last_year are per results_df row
+AnalysisData = namedtuple("AnalysisData", [
+    "results_df", "display_df", "year_cols", "year_arr", "material_index", "year_mask", "last_year"
+])
+
+@st.cache_data(show_spinner=False)
+def build_results(file_bytes, filename):
+    """Parse, clean, tabulate and format an uploaded file; cached on its contents"""
+    df = load_and_clean_data(file_bytes, filename)
+    
+    required_cols = ["Material Discription", "Unit Price"]
+    missing_cols = [col for col in required_cols if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
+    
+    # Detect year columns
+    year_cols = detect_year_columns(df)
+    if not year_cols:
+        raise ValueError("No year columns found in the data (e.g., 2021, FY21)")
+    df[year_cols] = df[year_cols].apply(pd.to_numeric, errors="coerce").astype("float32")
+    
+    # Filter and clean data
+    unit_price = pd.to_numeric(df["Unit Price"], errors="coerce")
+    valid_price = unit_price.notna() & unit_price.gt(0)
+    df = df.loc[valid_price].copy()
+    df["Unit Price"] = unit_price[valid_price].to_numpy()
+    
+    # Prepare results
+    years = [convert_to_year(col) for col in year_cols]
+    qty = df[year_cols]
+    qty = qty.where(qty.gt(0))
+    used = qty.notna().to_numpy()
+    
+    # Only include equipment with valid data
+    keep = used.any(axis=1)
+    # Skip years nobody used, which never got columns in the per-row records
+    has_usage = used.any(axis=0)
+    years = [year for year, u in zip(years, has_usage) if u]
+    qty, used = qty.loc[keep, has_usage], used[keep][:, has_usage]
+    base_price = df["Unit Price"].to_numpy()[keep]
+    totals = pd.DataFrame(
+        qty.to_numpy() * base_price[:, None],
+        index=qty.index,
+        columns=[f"{year} Total" for year in years]
+    )
+    qty.columns = [f"{year} Units" for year in years]
+    ids = pd.DataFrame({
+        "Material": pd.Categorical(df["Material Discription"].to_numpy()[keep]),
+        "Unit Price": base_price
+    }, index=qty.index)
+    results_df = pd.concat([ids, qty, totals], axis=1).reset_index(drop=True)
+    
+    # Usage years as a per-row bitmask, bit j set when year_arr[j] was used
+    year_arr = np.array(years)
+    year_mask = np.packbits(used, axis=1, bitorder="little")
+    last_year = year_arr[len(years) - 1 - used[:, ::-1].argmax(axis=1)]
+    
+    # Row of the first record for each material, for O(1) lookups
+    first = ~results_df["Material"].duplicated()
+    material_index = dict(zip(results_df["Material"][first], np.flatnonzero(first)))
+    
+    # Dynamically create display columns based on detected years
+    column_order = ['Material', 'Unit Price']
+    for year in years:
+        column_order.append(f"{year} Units")
+        column_order.append(f"{year} Total")
+    
+    display_df = results_df[column_order].copy()
+    # Apply Indian formatting to numeric columns
+    for col in display_df.columns:
+        if display_df[col].dtype in [np.float32, np.float64, np.int64]:
+            display_df[col] = format_indian_series(display_df[col])
+    # Arrow-backed strings serialize to st.dataframe without an object-column conversion
+    display_df = display_df.astype("string[pyarrow]")
+    return AnalysisData(results_df, display_df, year_cols, year_arr, material_index, year_mask, last_year)
 
 def main():
     st.title("📊 OEM Inventory Analysis System")
@@ -182,6 +310,7 @@ def main():
         col1, col2 = st.columns([1, 2])
         with col1:
             if lottie_animation:
+                from streamlit_lottie import st_lottie
                 st_lottie(lottie_animation, height=150, key="header-animation")
         with col2:
             st.markdown("<div class='header'><h1>📈 Inventory Analysis System</h1></div>", unsafe_allow_html=True)
@@ -189,56 +318,13 @@ def main():
     
     # Load and process data
     with st.spinner("Processing data..."):
-        df = load_and_clean_data(uploaded_file)
-        if df is None:
+        try:
+            data = build_results(uploaded_file.getvalue(), uploaded_file.name)
+        except ValueError as e:
+            st.error(str(e))
             return
             
-        required_cols = ["Material Discription", "Unit Price"]
-        missing_cols = [col for col in required_cols if col not in df.columns]
-        if missing_cols:
-            st.error(f"Missing required columns: {', '.join(missing_cols)}")
-            return
-        
-        # Detect year columns
-        year_cols = detect_year_columns(df)
-        if not year_cols:
-            st.error("No year columns found in the data (e.g., 2021, FY21)")
-            return
-            
-        st.success(f"Detected year columns: {', '.join(map(str, year_cols))}")
-        
-        # Filter and clean data
-        df = df.dropna(subset=["Unit Price"])
-        df["Unit Price"] = pd.to_numeric(df["Unit Price"], errors="coerce")
-        df = df[df["Unit Price"] > 0]
-        
-        # Prepare results
-        results = []
-        for _, row in df.iterrows():
-            material = row["Material Discription"]
-            base_price = row["Unit Price"]
-            record = {"Material": material, "Unit Price": base_price}
-            last_year = None
-            history_years = []
-            
-            # Process year columns
-            for col in year_cols:
-                year = convert_to_year(col)
-                qty = pd.to_numeric(row[col], errors="coerce")
-                if pd.notna(qty) and qty > 0:
-                    record[f"{year} Units"] = qty
-                    record[f"{year} Total"] = base_price * qty
-                    last_year = year
-                    history_years.append(year)
-            
-            # Only include equipment with valid data
-            if last_year and history_years:
-                record["_base"] = base_price
-                record["_last_year"] = last_year
-                record["_historical_years"] = history_years
-                results.append(record)
-        
-        results_df = pd.DataFrame(results)
+        st.success(f"Detected year columns: {', '.join(map(str, data.year_cols))}")
 
     # Custom price prediction
     with st.container():
@@ -246,7 +332,7 @@ def main():
         col1, col2, col3 = st.columns([2, 2, 1])
         
         with col1:
-            materials = results_df["Material"].unique()
+            materials = data.results_df["Material"].cat.categories
             material_sel = st.selectbox("Select Inventory", materials, key="material_select")
         with col2:
             target_year = st.number_input("Target Year", min_value=2023, max_value=2100, value=2028, key="year_input")
@@ -255,9 +341,9 @@ def main():
             predict_btn = st.button("Predict Unit Price", use_container_width=True)
         
         if predict_btn:
-            material_data = results_df[results_df["Material"] == material_sel].iloc[0]
-            base_price = material_data["_base"]
-            last_year = material_data["_last_year"]
+            row = data.material_index[material_sel]
+            base_price = data.results_df["Unit Price"].iat[row]
+            last_year = int(data.last_year[row])
             
             if target_year <= last_year:
                 st.error("Target year must be after last historical year")
@@ -281,31 +367,21 @@ def main():
                     time.sleep(0.5)
                     
                     # Prepare replenishment data
-                    replenishment_data = []
-                    for idx, row in results_df.iterrows():
-                        material = row["Material"]
-                        historical_years = row["_historical_years"]
-                        
-                        if len(historical_years) < 2:
-                            continue
-                            
-                        events = predict_replenishment_events(
-                            historical_years, 
-                            target_year_replenish
-                        )
-                        
-                        if events:
-                            for event_year in events:
-                                replenishment_data.append({
-                                    "Inventory": material,
-                                    "Last Usage": max(historical_years),
-                                    "Replenishment Year": event_year,
-                                    "Lifetime (years)": event_year - max(historical_years)
-                                })
+                    used = year_presence(data.year_mask, data.year_arr)
+                    rows, last_usage, events = predict_replenishment_events(
+                        data.year_arr, 
+                        used, 
+                        target_year_replenish
+                    )
                     
-                    if replenishment_data:
+                    if len(events):
                         # Create DataFrame and sort
-                        replenishment_df = pd.DataFrame(replenishment_data)
+                        replenishment_df = pd.DataFrame({
+                            "Inventory": data.results_df["Material"].to_numpy()[rows],
+                            "Last Usage": last_usage,
+                            "Replenishment Year": events,
+                            "Lifetime (years)": events - last_usage
+                        })
                         replenishment_df = replenishment_df.sort_values(by="Replenishment Year")
                         
                         # Display results
@@ -317,38 +393,20 @@ def main():
                         )
                         
                         # Show timeline visualization
-                        fig, ax = plt.subplots(figsize=(12, 6))
-                        
-                        # Group by year
                         year_counts = replenishment_df["Replenishment Year"].value_counts().sort_index()
-                        
-                        ax.bar(year_counts.index, year_counts.values, color='#4B8DF8')
-                        ax.set_title(f'Replenishment Events by Year')
-                        ax.set_xlabel('Year')
-                        ax.set_ylabel('Number of Replenishments')
-                        ax.grid(axis='y', linestyle='--', alpha=0.7)
-                        st.pyplot(fig)
+                        st.subheader("Replenishment Events by Year")
+                        st.bar_chart(
+                            year_counts.rename_axis("Year").rename("Replenishments"),
+                            color="#4B8DF8"
+                        )
                     else:
                         st.info("No replenishment predicted for any inventory by the target year")
 
     # Data display section
     with st.container():
         st.markdown("<div class='card'><h2>📋 Inventory Usage History</h2></div>", unsafe_allow_html=True)
-        
-        # Dynamically create columns based on detected years
-        column_order = ['Material', 'Unit Price']
-        year_columns = [col for col in results_df.columns if re.match(r'\d{4} Units', col)]
-        for col in year_columns:
-            column_order.append(col)
-            column_order.append(col.replace('Units', 'Total'))
-        
-        display_df = results_df[column_order].copy()
-        # Apply Indian formatting to numeric columns
-        for col in display_df.columns:
-            if display_df[col].dtype in [np.float64, np.int64]:
-                display_df[col] = display_df[col].apply(format_indian_number)
         st.dataframe(
-            display_df,
+            data.display_df,
             use_container_width=True,
             height=500
         )